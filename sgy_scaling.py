@@ -1,17 +1,41 @@
 #!/usr/bin/env python3
 """
-SGY Scaling Tool - Robust Version with Header Fix
-------------------------------------------------
+SGY Scaling Tool - Streaming Version
+------------------------------------
 This script normalizes all SEG-Y (.sgy) seismic files in a given input folder
 by dividing each trace by the global maximum amplitude across all files.
-Fixes header overflow issues when writing by using segyio.
+IEEE float files are read through memory maps and streamed to the output with
+all headers passed through byte for byte. Files that need decoding (e.g. IBM
+float) are decoded once with segyio in step 1 and rescaled in place in step 2.
 """
 import os
+import json
+import mmap
+import struct
+import sys
 from tqdm import tqdm
 from multiprocessing import Pool, cpu_count
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
+from functools import partial
+from itertools import islice
 import numpy as np
 import warnings
-import shutil
+
+try:
+    import segyio
+except ImportError:  # reported in main, the rest of the module loads without it
+    segyio = None
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the NumPy kernel is used instead
+    njit = None
+
+try:
+    import zfpy
+except ImportError:  # only needed for ZFP_TOLERANCE
+    zfpy = None
 
 # Suppress warnings for cleaner output
 warnings.filterwarnings('ignore')
@@ -22,71 +46,505 @@ warnings.filterwarnings('ignore')
 INPUT_FOLDER = r"D:\Haimerl\PhD\ML\Data_Unscaled"
 OUTPUT_FOLDER = r"L:\win\AG_Marine_Geophysics\beni\machine-learning\beni"
 ERROR_LOG = os.path.join(OUTPUT_FOLDER, "error_log.txt")
+MAX_CACHE = os.path.join(OUTPUT_FOLDER, "_maxcache.json")   # per-file maxima from earlier runs
 NUM_CORES = max(1, int(cpu_count() * 0.85))   # change number to use more cores
+IO_BUFFER_SIZE = 4 * 1024 * 1024   # bytes per read/write block, roughly a filesystem stripe
+ZFP_TOLERANCE = None   # None: SEG-Y only; 0: also write lossless .zfp sidecars; >0: lossy with this max. error
+TRACE_STRIDE = 1   # >1: estimate IEEE file maxima from every n-th trace, then re-check the top files exactly
 
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# SEG-Y layout constants
+REEL_HEADER_SIZE = 3600      # textual (3200) + binary (400) header
+TRACE_HEADER_SIZE = 240
+TRACE_HEADER_WORDS = TRACE_HEADER_SIZE // 4
+FORMAT_IEEE_FLOAT = 5
+TEXT_HEADER_SIZE = 3200
+DECODED_SUFFIX = ".ieee.tmp"  # step-1 IEEE copy of files that need decoding (e.g. IBM floats)
+PARTIAL_SUFFIX = ".part"      # streamed output until it is complete
+
 # -------------------------
 # Helper Functions
 # -------------------------
-def find_file_max(filepath):
-    """Findet Maximum in einer einzelnen Datei"""
+def fadvise(f, advice_name):
+    """Passes an access-pattern hint for an open file to the kernel (no-op where unsupported)"""
+    advice = getattr(os, advice_name, None)
+    if advice is None:
+        return
+    try:
+        os.posix_fadvise(f.fileno(), 0, 0, advice)
+    except OSError:
+        pass
+
+def madvise_sequential(traces):
+    """Asks the kernel for aggressive readahead on a memmap (no-op where unsupported)"""
+    try:
+        traces._mmap.madvise(mmap.MADV_SEQUENTIAL)
+    except (AttributeError, OSError, ValueError):
+        pass
+
+def read_ieee_layout(filepath):
+    """Returns (samples, traces, data offset) for a fixed-length IEEE float SEG-Y, otherwise None"""
+    with open(filepath, 'rb') as f:
+        reel_header = f.read(REEL_HEADER_SIZE)
+    if len(reel_header) < REEL_HEADER_SIZE:
+        return None
+    samples = struct.unpack('>h', reel_header[3220:3222])[0]
+    data_format = struct.unpack('>h', reel_header[3224:3226])[0]
+    extended_headers = struct.unpack('>h', reel_header[3504:3506])[0]
+    if data_format != FORMAT_IEEE_FLOAT or samples <= 0 or extended_headers < 0:
+        return None
+    data_offset = REEL_HEADER_SIZE + extended_headers * TEXT_HEADER_SIZE
+    trace_size = TRACE_HEADER_SIZE + samples * 4
+    body_size = os.path.getsize(filepath) - data_offset
+    if body_size < 0 or body_size % trace_size != 0:
+        return None
+    return samples, body_size // trace_size, data_offset
+
+def open_ieee_traces(filepath, mode='r', sequential=True, dtype='>f4'):
+    """Memory-maps an IEEE float SEG-Y as a (traces, 60 + samples) array of 4-byte words.
+
+    By default the words are big-endian float32; pass dtype=np.uint32 to get the
+    raw words for in-place byteswapping (see byteswap_samples).
+    The first 60 columns overlay the 240-byte trace headers. Returns None if the
+    file is not IEEE float or has no fixed trace length (use segyio instead).
+    With sequential=True the kernel is told the mapping is scanned front to back.
+    """
+    layout = read_ieee_layout(filepath)
+    if layout is None:
+        return None
+    samples, traces, data_offset = layout
+    if traces == 0:
+        return np.zeros((0, TRACE_HEADER_WORDS + samples), dtype=dtype)
+    traces = np.memmap(filepath, dtype=dtype, mode=mode, offset=data_offset,
+                       shape=(traces, TRACE_HEADER_WORDS + samples))
+    if sequential:
+        madvise_sequential(traces)
+    return traces
+
+def traces_per_block(trace_bytes):
+    """Number of traces that fit into one IO_BUFFER_SIZE block (at least 1)"""
+    return max(1, IO_BUFFER_SIZE // max(1, trace_bytes))
+
+def abs_max(data):
+    """Largest finite absolute amplitude in an array (0 if there is none)"""
+    if data.size == 0:
+        return 0
+    data_max = np.abs(data).max()
+    if not np.isfinite(data_max):
+        # Rare: NaN/Inf samples present, only then pay for a masked reduction
+        data = data[np.isfinite(data)]
+        data_max = np.abs(data).max() if data.size else 0
+    return float(data_max)
+
+def blockwise_abs_max(data, threads=1):
+    """abs_max over IO_BUFFER_SIZE blocks of traces, spread over threads (NumPy releases the GIL)"""
+    block_traces = traces_per_block(data.shape[1] * 4)
+    blocks = [data[start:start + block_traces] for start in range(0, len(data), block_traces)]
+    if threads <= 1 or len(blocks) <= 1:
+        return max(map(abs_max, blocks), default=0)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return max(executor.map(abs_max, blocks))
+
+def iter_files(root, suffix):
+    """Yields the paths of all files below root ending in suffix (one scandir per directory)"""
+    try:
+        entries = os.scandir(root)
+    except OSError:
+        # Like os.walk: skip unreadable or vanished directories
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path, suffix)
+            elif entry.name.lower().endswith(suffix):
+                yield entry.path
+
+def iter_sgy_files(root):
+    """Yields the paths of all .sgy files below root"""
+    return iter_files(root, '.sgy')
+
+def remove_decoded_copies(root):
+    """Deletes step-1 IEEE copies (DECODED_SUFFIX) left below root"""
+    for path in iter_files(root, DECODED_SUFFIX):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def load_max_cache(cache_path):
+    """Loads the per-file maximum cache, {} if there is none or it is unreadable"""
     try:
-        import segyio
-        with segyio.open(filepath, 'r', ignore_geometry=True) as f:
-            maxima = []
-            for trace in f.trace:
-                if len(trace) > 0:
-                    trace_max = np.nanmax(np.abs(trace))
-                    if np.isfinite(trace_max) and trace_max > 0:
-                        maxima.append(trace_max)
-            return max(maxima) if maxima else 0
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_max_cache(cache_path, cache):
+    """Writes the per-file maximum cache atomically"""
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(tmp_path, cache_path)
+
+def cache_entry(filepath, file_max, trace_stride):
+    """Cache record tying a file maximum to the file's current mtime and size"""
+    stat = os.stat(filepath)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+            "max": file_max, "stride": trace_stride}
+
+def cached_max(cache, filepath, trace_stride):
+    """Cached maximum of an unchanged file (sampled no coarser than trace_stride), else None"""
+    entry = cache.get(os.path.abspath(filepath))
+    if entry is None or entry["stride"] > trace_stride:
+        return None
+    stat = os.stat(filepath)
+    if entry["mtime_ns"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+        return None
+    return entry["max"]
+
+def output_path_for(filepath, input_folder, output_folder):
+    """Mirrors the input folder structure below output_folder and returns the output path"""
+    relative_path = os.path.relpath(os.path.dirname(filepath), input_folder)
+    output_dir = os.path.join(output_folder, relative_path)
+    os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, os.path.basename(filepath))
+
+def ensure_not_input(filepath, output_path):
+    """Refuses to write an output that is the input file itself (overlapping folders)"""
+    if os.path.exists(output_path) and os.path.samefile(filepath, output_path):
+        raise ValueError(f"Output would overwrite the input {os.path.basename(filepath)}; "
+                         "OUTPUT_FOLDER must not be INPUT_FOLDER")
+
+def decode_to_ieee(filepath, output_path):
+    """Writes an IEEE float copy of a SEG-Y that needs segyio to decode; returns its maximum"""
+    try:
+        with segyio.open(filepath, 'r', ignore_geometry=True) as src:
+            spec = segyio.tools.metadata(src)
+            spec.format = FORMAT_IEEE_FLOAT
+            with segyio.create(output_path, spec) as dst:
+                for i in range(spec.ext_headers + 1):
+                    dst.text[i] = src.text[i]
+                dst.bin = src.bin
+                dst.bin.update(format=FORMAT_IEEE_FLOAT)
+                dst.header = src.header
+                # Bulk reads of whole blocks of traces instead of one Python call per trace
+                block_traces = traces_per_block(len(spec.samples) * 4)
+                file_max = 0
+                for start in range(0, spec.tracecount, block_traces):
+                    stop = min(start + block_traces, spec.tracecount)
+                    data = src.trace.raw[start:stop]
+                    dst.trace[start:stop] = data
+                    file_max = max(file_max, abs_max(data))
+        return file_max
+    except BaseException:
+        # Never leave a partial copy behind for step 2 to pick up
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+def find_file_max(filepath, trace_stride=1):
+    """Findet Maximum in einer einzelnen Datei, returns (filepath, maximum, decoded)
+
+    decoded is True if an IEEE copy was written for step 2 to rescale.
+    """
+    try:
+        # Readahead would pull in the skipped traces when sampling
+        traces = open_ieee_traces(filepath, sequential=trace_stride == 1)
+        if traces is not None:
+            # IEEE floats: scan the raw sample block directly, no trace decoding.
+            # Striding over traces skips their pages on disk; amplitudes are
+            # spatially coherent, so the estimate is close to the true maximum.
+            return filepath, blockwise_abs_max(traces[::trace_stride, TRACE_HEADER_WORDS:],
+                                               WORKER_THREADS), False
+
+        # IBM floats and irregular files: decode once with segyio and keep the
+        # IEEE result, so step 2 only has to rescale it in place
+        output_path = output_path_for(filepath, WORKER_INPUT_FOLDER, WORKER_OUTPUT_FOLDER)
+        ensure_not_input(filepath, output_path)
+        return filepath, decode_to_ieee(filepath, output_path + DECODED_SUFFIX), True
     except Exception as e:
         print(f"\nError reading {os.path.basename(filepath)}: {str(e)[:100]}")
-        return 0
+        return filepath, 0, False
+
+def byteswap_samples(words):
+    """Flips uint32 sample words between big-endian SEG-Y and native order in place.
+
+    Returns the words viewed as native float32. Calling it again restores the
+    on-disk byte order; on big-endian machines nothing is swapped.
+    """
+    if sys.byteorder == 'little':
+        words.byteswap(inplace=True)
+    return words.view(np.float32)
+
+def scale_traces_numpy(data, inv_scale):
+    """Scales a (traces, samples) float32 block in place, zeroing NaN/Inf; returns valid trace count"""
+    data *= inv_scale
+    finite = np.isfinite(data)
+    if finite.all():
+        return len(data)
+    valid_traces = int(finite.any(axis=1).sum())
+    # Zero NaN/Inf through the (reused) mask, no temporary float array
+    np.copyto(data, np.float32(0), where=np.logical_not(finite, out=finite))
+    return valid_traces
+
+if njit is not None:
+    # fastmath without 'nnan'/'ninf', otherwise the isfinite check could be optimized away.
+    # nogil instead of parallel: files are scaled from a thread pool, which the
+    # default numba threading layer does not support for parallel kernels.
+    @njit(nogil=True, fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'}, cache=True)
+    def scale_traces(data, inv_scale):
+        """Fused scale + sanitize kernel (same contract as scale_traces_numpy)"""
+        valid = np.zeros(data.shape[0], dtype=np.bool_)
+        for i in range(data.shape[0]):
+            row = data[i]
+            for j in range(row.size):
+                v = row[j] * inv_scale
+                if np.isfinite(v):
+                    valid[i] = True
+                else:
+                    v = 0.0
+                row[j] = v
+        return valid.sum()
+else:
+    scale_traces = scale_traces_numpy
+
+def iter_completed(executor, fn, items, window):
+    """Yields fn(item) results in completion order with at most window tasks in flight"""
+    items = iter(items)
+    pending = {executor.submit(fn, item) for item in islice(items, window)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+        pending.update(executor.submit(fn, item) for item in islice(items, len(done)))
+
+class ZfpSidecar:
+    """Block-wise ZFP copy of a file's scaled samples: <name>.zfp plus a <name>.json index.
+
+    Every block of traces is compressed while it is scaled and stored as its own
+    ZFP stream, so only one block per thread is held in memory. The JSON lists
+    each block's first trace, trace count, byte offset and length. tolerance 0
+    selects ZFP's lossless mode.
+    """
 
-def scale_and_save(args):
-    """Skaliert und speichert eine einzelne Datei - using segyio to avoid header issues"""
-    filepath, global_max, input_folder, output_folder = args
+    def __init__(self, output_path, tolerance):
+        self.base_path = os.path.splitext(output_path)[0]
+        self.segy_name = os.path.basename(output_path)
+        self.tolerance = tolerance
+        self.samples = 0
+        self.blocks = []
+        self.file = open(self.base_path + ".zfp", 'wb', buffering=IO_BUFFER_SIZE)
+
+    def compress(self, samples):
+        """Compresses a native float32 (traces, samples) block; safe to call from any thread"""
+        samples = np.ascontiguousarray(samples)
+        if self.tolerance > 0:
+            return zfpy.compress_numpy(samples, tolerance=self.tolerance)
+        return zfpy.compress_numpy(samples)
+
+    def write(self, first_trace, samples, compressed):
+        """Appends a compressed block (from one thread at a time, in any trace order)"""
+        self.samples = samples.shape[1]
+        self.blocks.append({"first_trace": first_trace, "traces": samples.shape[0],
+                            "offset": self.file.tell(), "bytes": len(compressed)})
+        self.file.write(compressed)
+
+    def finish(self, global_max):
+        """Closes the stream file and writes the JSON index"""
+        self.file.close()
+        self.blocks.sort(key=lambda block: block["first_trace"])
+        with open(self.base_path + ".json", 'w', encoding='utf-8') as f:
+            json.dump({"segy": self.segy_name,
+                       "traces": sum(block["traces"] for block in self.blocks),
+                       "samples": self.samples, "dtype": "float32",
+                       "global_max": float(global_max), "zfp_tolerance": self.tolerance,
+                       "blocks": self.blocks}, f, indent=1)
+
+    def discard(self):
+        """Closes and deletes an unfinished sidecar"""
+        self.file.close()
+        for path in (self.base_path + ".zfp", self.base_path + ".json"):
+            if os.path.exists(path):
+                os.remove(path)
+
+def scale_traces_split(data, inv_scale, executor=None, parts=1):
+    """Runs scale_traces over row chunks of data on the executor's threads (kernels release the GIL)"""
+    if executor is None or parts <= 1 or len(data) < parts:
+        return scale_traces(data, inv_scale)
+    chunks = np.array_split(data, parts)
+    return sum(executor.map(lambda chunk: scale_traces(chunk, inv_scale), chunks))
+
+def scale_ieee_file(filepath, output_path, layout, inv_scale, threads=1, sidecar=None):
+    """Writes a scaled copy of an IEEE float SEG-Y in one streaming pass.
+
+    Reel and trace headers are passed through byte for byte; only the sample
+    blocks are decoded, multiplied by inv_scale and re-encoded, IO_BUFFER_SIZE
+    bytes of traces at a time. Each scaled block is also added to sidecar, if
+    given. The output is written under a temporary name and only moved into
+    place once complete. Returns the number of traces with finite samples.
+    """
+    partial_path = output_path + PARTIAL_SUFFIX
+    try:
+        valid_traces = stream_scaled_blocks(filepath, partial_path, layout, inv_scale,
+                                            threads, sidecar)
+        os.replace(partial_path, output_path)
+    except BaseException:
+        # Never leave a truncated file that looks like a finished output
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    
+    return valid_traces
+
+def stream_scaled_blocks(filepath, output_path, layout, inv_scale, threads, sidecar):
+    """Streaming loop of scale_ieee_file, writing straight to output_path"""
+    samples, traces, data_offset = layout
+    trace_size = TRACE_HEADER_SIZE + samples * 4
+    block_traces = traces_per_block(trace_size)
+    buffer = bytearray(block_traces * trace_size)
+    view = memoryview(buffer)
+    valid_traces = 0
+    
+    with (ThreadPoolExecutor(max_workers=threads) if threads > 1 else nullcontext()) as executor, \
+            open(filepath, 'rb', buffering=IO_BUFFER_SIZE) as src, \
+            open(output_path, 'wb', buffering=IO_BUFFER_SIZE) as dst:
+        fadvise(src, 'POSIX_FADV_SEQUENTIAL')
+        fadvise(dst, 'POSIX_FADV_SEQUENTIAL')
+        dst.write(src.read(data_offset))
+        for start in range(0, traces, block_traces):
+            count = min(block_traces, traces - start)
+            nbytes = count * trace_size
+            if src.readinto(view[:nbytes]) != nbytes:
+                raise EOFError(f"Truncated trace in {os.path.basename(filepath)}")
+            # Swap once in, scale native float32 in the buffer, swap once out
+            block = np.frombuffer(buffer, dtype=np.uint32, count=nbytes // 4)
+            words = block.reshape(count, -1)[:, TRACE_HEADER_WORDS:]
+            samples = byteswap_samples(words)
+            valid_traces += scale_traces_split(samples, inv_scale, executor, threads)
+            if sidecar is not None:
+                sidecar.write(start, samples, sidecar.compress(samples))
+            byteswap_samples(words)
+            dst.write(view[:nbytes])
+            del block, words, samples
+        # Last read of the source: drop its pages instead of evicting others
+        fadvise(src, 'POSIX_FADV_DONTNEED')
+    
+    return valid_traces
+
+def scale_ieee_in_place(filepath, inv_scale, threads=1, sidecar=None):
+    """Scales an IEEE float SEG-Y in place through a writable memmap; returns valid trace count
+
+    Each scaled block is also added to sidecar, if given.
+    """
+    traces = open_ieee_traces(filepath, mode='r+', dtype=np.uint32)
+    if traces is None:
+        raise ValueError(f"{os.path.basename(filepath)} is not a fixed-length IEEE SEG-Y")
+    block_traces = traces_per_block(traces.shape[1] * 4)
+    
+    def scale_rows(start):
+        words = traces[start:start + block_traces, TRACE_HEADER_WORDS:]
+        samples = byteswap_samples(words)
+        valid = scale_traces(samples, inv_scale)
+        compressed = sidecar.compress(samples) if sidecar is not None else None
+        byteswap_samples(words)
+        return start, valid, compressed
+    
+    def add_block(result):
+        start, valid, compressed = result
+        if compressed is not None:
+            sidecar.write(start, traces[start:start + block_traces, TRACE_HEADER_WORDS:],
+                          compressed)
+        return valid
+    
+    # Blocks are disjoint, so they can be scaled concurrently; sidecar writes
+    # stay on this thread and a bounded window limits blocks held in memory
+    starts = range(0, len(traces), block_traces)
+    if threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            valid_traces = sum(map(add_block, iter_completed(executor, scale_rows, starts,
+                                                             threads * 2)))
+    else:
+        valid_traces = sum(map(add_block, map(scale_rows, starts)))
+    if isinstance(traces, np.memmap):
+        traces.flush()
+    
+    return valid_traces
+
+# Per-run state, set once per worker by init_worker
+WORKER_GLOBAL_MAX = None
+WORKER_INV_SCALE = None
+WORKER_INPUT_FOLDER = None
+WORKER_OUTPUT_FOLDER = None
+WORKER_THREADS = 1
+WORKER_DECODED_FILES = frozenset()
+
+def init_worker(global_max, input_folder, output_folder, threads_per_file=1,
+                decoded_files=frozenset()):
+    """Stores the shared run arguments so tasks only carry a file path"""
+    global WORKER_GLOBAL_MAX, WORKER_INV_SCALE, WORKER_INPUT_FOLDER, WORKER_OUTPUT_FOLDER, WORKER_THREADS
+    global WORKER_DECODED_FILES
+    WORKER_GLOBAL_MAX = global_max
+    # Scaling multiplies by the reciprocal, computed once per worker
+    WORKER_INV_SCALE = np.float32(1.0 / global_max) if global_max else None
+    WORKER_INPUT_FOLDER = input_folder
+    WORKER_OUTPUT_FOLDER = output_folder
+    WORKER_THREADS = threads_per_file
+    WORKER_DECODED_FILES = decoded_files
+    if global_max and njit is not None:
+        # Compile (or load the cached) kernel before the first task. The
+        # sliced view matches the non-contiguous blocks it is called with.
+        scale_traces(np.zeros((2, 2), dtype=np.float32)[:, 1:], np.float32(1.0))
+
+def scale_and_save(filepath):
+    """Skaliert und speichert eine einzelne Datei - IEEE files are streamed with headers
+    passed through, decoded files are rescaled in place from their step-1 IEEE copy"""
+    inv_scale = WORKER_INV_SCALE
+    decoded_path = None
+    sidecar = None
     
     try:
-        import segyio
-        
-        # Recreate output folder structure
-        relative_path = os.path.relpath(os.path.dirname(filepath), input_folder)
-        output_dir = os.path.join(output_folder, relative_path)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Output path
-        output_path = os.path.join(output_dir, os.path.basename(filepath))
+        output_path = output_path_for(filepath, WORKER_INPUT_FOLDER, WORKER_OUTPUT_FOLDER)
+        # Both paths replace output_path, which must never be the input itself
+        ensure_not_input(filepath, output_path)
+        if ZFP_TOLERANCE is not None:
+            sidecar = ZfpSidecar(output_path, ZFP_TOLERANCE)
         
-        # Copy original file first to preserve all headers
-        shutil.copy2(filepath, output_path)
-        
-        # Open copied file and modify traces in-place
-        with segyio.open(output_path, 'r+', ignore_geometry=True) as f:
-            valid_traces = 0
-            for i in range(len(f.trace)):
-                trace = f.trace[i]
-                if len(trace) > 0:
-                    # Check for valid data
-                    if not np.all(np.isnan(trace)) and not np.all(np.isinf(trace)):
-                        # Scale by global maximum
-                        scaled = trace / global_max
-                        # Handle any resulting NaN/Inf
-                        scaled = np.nan_to_num(scaled, nan=0.0, posinf=0.0, neginf=0.0)
-                        # Write back
-                        f.trace[i] = scaled.astype(np.float32)
-                        valid_traces += 1
+        layout = read_ieee_layout(filepath)
+        if layout is not None:
+            # IEEE floats: single streaming pass, no copy of the source file
+            valid_traces = scale_ieee_file(filepath, output_path, layout, inv_scale,
+                                           WORKER_THREADS, sidecar)
+        else:
+            # IBM floats and irregular files: rescale the IEEE copy decoded in
+            # step 1 of this run (decode now if the maximum came from the cache)
+            # and move it into place
+            decoded_path = output_path + DECODED_SUFFIX
+            if filepath not in WORKER_DECODED_FILES:
+                decode_to_ieee(filepath, decoded_path)
+            valid_traces = scale_ieee_in_place(decoded_path, inv_scale, WORKER_THREADS,
+                                               sidecar)
+            os.replace(decoded_path, output_path)
         
         if valid_traces == 0:
+            if sidecar is not None:
+                sidecar.discard()
             return (False, filepath, "No valid traces to scale")
         
+        if sidecar is not None:
+            sidecar.finish(WORKER_GLOBAL_MAX)
+        
         return (True, filepath, f"Success ({valid_traces} traces)")
         
-    except ImportError:
-        return (False, filepath, "segyio library not installed - run: pip install segyio")
     except Exception as e:
+        if sidecar is not None:
+            sidecar.discard()
+        # A decoded copy may be partially scaled now, never leave it for a re-run
+        if decoded_path is not None:
+            try:
+                os.remove(decoded_path)
+            except OSError:
+                pass
         error_msg = f"{type(e).__name__}: {str(e)[:200]}"
         return (False, filepath, error_msg)
 
@@ -95,19 +553,17 @@ def scale_and_save(args):
 # -------------------------
 if __name__ == '__main__':
     # Check if segyio is installed
-    try:
-        import segyio
-    except ImportError:
+    if segyio is None:
         print("ERROR: segyio library is required but not installed.")
         print("Please install it using: pip install segyio")
         exit(1)
+    if ZFP_TOLERANCE is not None and zfpy is None:
+        print("ERROR: ZFP_TOLERANCE is set but the zfpy library is not installed.")
+        print("Please install it using: pip install zfpy")
+        exit(1)
     
     # Collect all SGY files
-    sgy_files = []
-    for root, dirs, files in os.walk(INPUT_FOLDER):
-        for filename in files:
-            if filename.lower().endswith('.sgy'):
-                sgy_files.append(os.path.join(root, filename))
+    sgy_files = list(iter_sgy_files(INPUT_FOLDER))
     
     print(f"Found {len(sgy_files)} SEG-Y files")
     print(f"Using {NUM_CORES} CPU cores")
@@ -116,61 +572,134 @@ if __name__ == '__main__':
     # Step 1: Find global maximum (parallel)
     # -------------------------
     print("\nStep 1: Finding global maximum...")
-    with Pool(NUM_CORES) as pool:
-        maxima = list(tqdm(
-            pool.imap(find_file_max, sgy_files),
-            total=len(sgy_files),
-            desc="Calculating global max"
-        ))
+    # Files unchanged since the last run reuse their cached maximum
+    max_cache = load_max_cache(MAX_CACHE)
+    file_maxima = {}
+    for f in sgy_files:
+        m = cached_max(max_cache, f, TRACE_STRIDE)
+        if m is not None:
+            file_maxima[f] = m
+    stale_files = [f for f in sgy_files if f not in file_maxima]
+    if file_maxima:
+        print(f"Reusing cached maxima for {len(file_maxima)} files")
+    
+    # Decoded copies from an interrupted run may already be (partially) scaled;
+    # step 2 only reuses copies decoded by this run's step 1
+    remove_decoded_copies(OUTPUT_FOLDER)
+    decoded_files = set()
+    
+    # Hand out files in batches to amortize IPC; order is irrelevant for a max
+    chunk = max(1, len(stale_files) // (NUM_CORES * 4))
+    # With fewer files than cores, each file is split across threads instead.
+    # The pool is only started if there is work, a fully cached run spawns nothing.
+    pool_args = dict(initializer=init_worker,
+                     initargs=(None, INPUT_FOLDER, OUTPUT_FOLDER,
+                               max(1, NUM_CORES // max(1, len(stale_files)))))
+    pool = None
+    try:
+        if stale_files:
+            pool = Pool(NUM_CORES, **pool_args)
+            for f, m, decoded in tqdm(
+                pool.imap_unordered(partial(find_file_max, trace_stride=TRACE_STRIDE),
+                                    stale_files, chunksize=chunk),
+                total=len(stale_files),
+                desc="Calculating global max"
+            ):
+                file_maxima[f] = m
+                if decoded:
+                    decoded_files.add(f)
+                if m > 0:
+                    # Decoded files are always scanned completely, so their maximum is exact
+                    max_cache[os.path.abspath(f)] = cache_entry(f, m, 1 if decoded else TRACE_STRIDE)
+        
+        if TRACE_STRIDE > 1 and file_maxima:
+            # Sampled maxima underestimate: rescan every IEEE file within 10% of
+            # the estimated global maximum (IBM files were decoded fully anyway)
+            estimate = max(file_maxima.values())
+            candidates = [f for f, m in file_maxima.items()
+                          if m >= 0.9 * estimate and cached_max(max_cache, f, 1) is None
+                          and read_ieee_layout(f) is not None]
+            if candidates and pool is None:
+                pool = Pool(NUM_CORES, **pool_args)
+            for f, m, _ in tqdm(
+                pool.imap_unordered(find_file_max, candidates) if candidates else [],
+                total=len(candidates),
+                desc="Confirming global max"
+            ):
+                file_maxima[f] = m
+                if m > 0:
+                    max_cache[os.path.abspath(f)] = cache_entry(f, m, 1)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    
+    save_max_cache(MAX_CACHE, max_cache)
     
     # Filter out zero/invalid maxima
-    valid_maxima = [m for m in maxima if m > 0 and np.isfinite(m)]
+    maxima = np.fromiter(file_maxima.values(), dtype=np.float64, count=len(file_maxima))
+    valid_maxima = maxima[np.isfinite(maxima) & (maxima > 0)]
     
-    if not valid_maxima:
+    if not valid_maxima.size:
         print("Error: No valid data found in any files. Cannot scale.")
+        remove_decoded_copies(OUTPUT_FOLDER)
         exit(1)
     
-    global_max = max(valid_maxima)
+    global_max = np.float32(valid_maxima.max())
     print(f"\nGlobal maximum amplitude: {global_max}")
     print(f"Valid files for max calculation: {len(valid_maxima)}/{len(sgy_files)}")
+    if TRACE_STRIDE > 1:
+        print(f"Note: TRACE_STRIDE = {TRACE_STRIDE}, the global maximum is an estimate from "
+              f"sampled traces. Scaled values may slightly exceed +/-1; use 1 for an exact maximum.")
     
     # -------------------------
     # Step 2: Scale and save (parallel)
     # -------------------------
+    # I/O bound: threads keep many reads/writes in flight without pickling or
+    # process startup, NumPy/numba release the GIL while scaling
     print("\nStep 2: Scaling and saving files...")
-    args_list = [(f, global_max, INPUT_FOLDER, OUTPUT_FOLDER) for f in sgy_files]
-    
-    with Pool(NUM_CORES) as pool:
-        results = list(tqdm(
-            pool.imap(scale_and_save, args_list),
-            total=len(args_list),
+    with ThreadPoolExecutor(max_workers=NUM_CORES * 2, initializer=init_worker,
+                            initargs=(global_max, INPUT_FOLDER, OUTPUT_FOLDER,
+                                      max(1, NUM_CORES // len(sgy_files)),
+                                      frozenset(decoded_files))) as executor:
+        # Count successes and stream failures to the log as they complete, so
+        # no per-file results are kept and the log is useful mid-run. Only a
+        # bounded window of tasks (two per worker thread) is in flight.
+        successful = 0
+        failed = 0
+        error_log = None
+        for success, filepath, error in tqdm(
+            iter_completed(executor, scale_and_save, sgy_files, NUM_CORES * 4),
+            total=len(sgy_files),
             desc="Scaling files"
-        ))
-    
-    # Analyze results
-    successful = sum(1 for r in results if r[0])
-    failed = [r for r in results if not r[0]]
+        ):
+            if success:
+                successful += 1
+                continue
+            failed += 1
+            if error_log is None:
+                error_log = open(ERROR_LOG, 'w', encoding='utf-8')
+                error_log.write(f"SGY Scaling Error Log\n")
+                error_log.write(f"{'='*60}\n")
+                error_log.write(f"Total files: {len(sgy_files)}\n\n")
+                error_log.write(f"Failed Files:\n")
+                error_log.write(f"{'-'*60}\n")
+            error_log.write(f"\nFile: {os.path.basename(filepath)}\n")
+            error_log.write(f"Path: {filepath}\n")
+            error_log.write(f"Error: {error}\n")
+            error_log.flush()
     
     print(f"\n{'='*60}")
     print(f"Scaling complete!")
     print(f"Successfully processed: {successful}/{len(sgy_files)} files")
-    print(f"Failed: {len(failed)} files")
-    
-    # Write error log
-    if failed:
-        print(f"\nWriting error log to: {ERROR_LOG}")
-        with open(ERROR_LOG, 'w', encoding='utf-8') as f:
-            f.write(f"SGY Scaling Error Log\n")
-            f.write(f"{'='*60}\n")
-            f.write(f"Total files: {len(sgy_files)}\n")
-            f.write(f"Successful: {successful}\n")
-            f.write(f"Failed: {len(failed)}\n\n")
-            f.write(f"Failed Files:\n")
-            f.write(f"{'-'*60}\n")
-            for success, filepath, error in failed:
-                f.write(f"\nFile: {os.path.basename(filepath)}\n")
-                f.write(f"Path: {filepath}\n")
-                f.write(f"Error: {error}\n")
+    print(f"Failed: {failed} files")
+    
+    # Finish error log
+    if error_log is not None:
+        error_log.write(f"\n{'-'*60}\n")
+        error_log.write(f"Successful: {successful}\n")
+        error_log.write(f"Failed: {failed}\n")
+        error_log.close()
+        print(f"\nError log written to: {ERROR_LOG}")
         print(f"See {ERROR_LOG} for details on failed files")
     else:
         print("\nAll files processed successfully!")